@@ -1,10 +1,11 @@
 #!/usr/bin/python
 import argparse
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
-from os import listdir, path
-import copy
+from os import path
+from functools import lru_cache
+from operator import itemgetter
 import re
 
 from echr.utils.folders import make_build_folder
@@ -18,9 +19,55 @@ from rich.progress import (
     BarColumn,
     TimeRemainingColumn,
 )
+# orjson is optional, load_json and dump_json fall back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 log = getlogger()
 
+BAD_PREFIX_RE = re.compile(r'^\W')
+HARD_CASES = frozenset(["001-154354", "001-108395", "001-79411"])
+AND_REPLACEMENTS = (
+    (' and art. ', ''),
+    (' and of ', '+'),
+    (' and ', '+')
+)
+
+
+def load_json(filename):
+    """
+        Read an object from a JSON file.
+
+        :param filename: path to the input file
+        :type filename: str
+        :return: deserialized object
+        :rtype: dict or list
+    """
+    if orjson is not None:
+        with open(filename, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dump_json(obj, filename):
+    """
+        Write an object to a JSON file, UTF-8 encoded with sorted keys and a 2-space indent.
+
+        :param obj: object to serialize
+        :type obj: dict or list
+        :param filename: path to the output file
+        :type filename: str
+    """
+    if orjson is not None:
+        with open(filename, 'wb') as outfile:
+            outfile.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    else:
+        with open(filename, 'w', encoding='utf-8') as outfile:
+            json.dump(obj, outfile, indent=2, sort_keys=True, ensure_ascii=False)
+
 
 def format_parties(parties):
     """
@@ -49,16 +96,13 @@ def split_and_format_article(article):
         :return: list of articles
         :rtype: [str]
     """
-    def remove_incorrect_prefixes(art):
-        if re.match(re.compile("^\W"), art):
-            return art[1:]
-        return art
-
+    match = BAD_PREFIX_RE.match
     parts = article.split('+')
-    articles = [remove_incorrect_prefixes(parts[-1])]
+    last = parts[-1]
+    articles = [last[1:] if match(last) else last]
     for k, e in enumerate(parts[:-1]):
         if not parts[k + 1].startswith(e):
-            articles.append(remove_incorrect_prefixes(e))
+            articles.append(e[1:] if match(e) else e)
     return articles
 
 
@@ -73,11 +117,12 @@ def find_base_articles(articles):
     """
     base_articles = []
     for a in articles:
-        a = a.split('+')[0]
+        a = a.partition('+')[0]
         if 'p' not in a.lower():
-            base_articles.append(a.split('-', 1)[0])
+            base_articles.append(a.partition('-')[0])
         else:
-            base_articles.append('-'.join(a.split('-')[0:2]))
+            head, sep, tail = a.partition('-')
+            base_articles.append(head + sep + tail.partition('-')[0])
     return base_articles
 
 
@@ -93,22 +138,23 @@ def merge_conclusion_elements(elements):
     final_elements = {}
     for e in elements:
         if 'article' in e and 'base_article' in e:
-            key = '{}_{}_{}'.format(e['article'], e['base_article'], e['element'])
+            key = f"{e['article']}_{e['base_article']}_{e['element']}"
         else:
             key = e['element']
-        if key not in final_elements:
+        existing = final_elements.get(key)
+        if existing is None:
             final_elements[key] = e
-        final_elements[key].update(e)
+        else:
+            existing.update(e)
     return list(final_elements.values())
 
 
 def get_element_type(l):
-    t = 'other'
     if l.startswith('violation'):
-        t = 'violation'
-    elif l.startswith('no-violation') or l.startswith('no violation'):
-        t = 'no-violation'
-    return t
+        return 'violation'
+    if l.startswith(('no-violation', 'no violation')):
+        return 'no-violation'
+    return 'other'
 
 
 def format_conclusion_elements(i, e, final_ccl):
@@ -123,8 +169,8 @@ def format_conclusion_elements(i, e, final_ccl):
 
     # Determine articles
     articles = []
-    if 'protocol' in e['element'].lower():
-        prot = e['element'].lower().split('protocol no.')
+    if 'protocol' in l:
+        prot = l.split('protocol no.')
         f1 = prot[0].split()[-2]
         f2 = prot[1].split()[0]
         final_ccl[i]['article'] = f'p{f2}-{f1}'
@@ -132,14 +178,11 @@ def format_conclusion_elements(i, e, final_ccl):
 
     if 'article' not in final_ccl[i] and t != 'other':
         art = None
-        find_and_replace = [
-            (' and art. ', ''),
-            (' and of ', '+'),
-            (' and ', '+')
-        ]
-        for p in find_and_replace:
-            if p[0] in l:
-                l = l.replace(p[0], p[1])
+        # Every pattern contains ' and ', most elements have none
+        if ' and ' in l:
+            for p in AND_REPLACEMENTS:
+                if p[0] in l:
+                    l = l.replace(p[0], p[1])
 
         b = l.split()
         for j, a in enumerate(b):
@@ -161,13 +204,40 @@ def format_conclusion_elements(i, e, final_ccl):
 
     base_articles = find_base_articles(articles)
     for k, art in enumerate(articles):
-        item = copy.copy(final_ccl[i])
-        item['article'] = art
-        item['base_article'] = base_articles[k]
-        to_append.append(item)
+        to_append.append({**final_ccl[i], 'article': art, 'base_article': base_articles[k]})
     return to_append
 
 
+def iter_conclusion_segments(ccl):
+    """
+        Iterate over the segments of a conclusion string in a single pass.
+
+        A segment is a piece of text closed by ')'. Without parenthesis, each of its ';'
+        separated parts is a segment on its own. Otherwise, the text before '(' is followed
+        by the ';' separated list found between the first and the second '('.
+
+        :param ccl: conclusion string
+        :type ccl: str
+        :return: text before the parenthesis and list of mentions, or None
+        :rtype: iterator of (str, [str])
+    """
+    start = 0
+    end = len(ccl)
+    while start < end:
+        stop = ccl.find(')', start)
+        if stop == -1:
+            stop = end
+        opening = ccl.find('(', start, stop)
+        if opening == -1:
+            for part in ccl[start:stop].split(';'):
+                if part:
+                    yield part, None
+        else:
+            closing = ccl.find('(', opening + 1, stop)
+            yield ccl[start:opening], ccl[opening + 1:stop if closing == -1 else closing].split(';')
+        start = stop + 1
+
+
 def format_conclusion(ccl):
     """
         Format a conclusion string into a list of elements:
@@ -202,18 +272,8 @@ def format_conclusion(ccl):
         :rtype: [dict]
     """
     final_ccl = []
-    chunks = [c for c in ccl.split(')') if len(c)]
-    art = []
-    for c in chunks:
-        if '(' not in c:
-            art.extend(c.split(';'))
-        else:
-            art.append(c)
-    art = [a for a in art if len(a) > 0]
-    for c in art:
-        a = c.split('(')
-        b = a[1].split(';') if len(a) > 1 else None
-        articles = [d.strip() for d in a[0].split(';')]
+    for c, b in iter_conclusion_segments(ccl):
+        articles = [d.strip() for d in c.split(';')]
         articles = [d for d in articles if len(d) > 0]
         if not len(articles):
             if b:
@@ -253,9 +313,8 @@ def format_article(article):
         :return: list of articles
         :rtype: [str]
     """
-    articles = article.lower().split(';')
-    return list(set(find_base_articles(
-        [item for sublist in list(map(split_and_format_article, articles)) for item in sublist])))
+    return list(dict.fromkeys(find_base_articles(
+        [a for part in article.lower().split(';') for a in split_and_format_article(part)])))
 
 
 def format_subarticle(article):
@@ -267,33 +326,101 @@ def format_subarticle(article):
         :return: list of subarticles
         :rtype: [str]
     """
-    articles = article.split(';')
-    articles = [a for sublist in articles for a in sublist.split('+')]
-    res = list(set(articles))
-    return res
+    return list(dict.fromkeys(a for part in article.split(';') for a in part.split('+')))
 
 
-def format_cases(console, cases):
+@lru_cache(maxsize=1)
+def load_countries():
     """
-        Format the cases from raw information
+        Return the countries indexed by their alpha-3 code.
 
-        :param cases: list of cases raw information
-        :type cases: [dict]
-        :return: list of formatted cases
-        :rtype: [dict]
+        The result is cached: copy an entry before handing it out, as format_case does.
+
+        :return: countries alpha-2 code and name
+        :rtype: dict
     """
-    COUNTRIES = {}
+    countries = {}
     with open(os.path.join('data', 'countries.json')) as f:
         data = json.load(f)
         for c in data:
-            COUNTRIES[c['alpha-3']] = {
+            countries[c['alpha-3']] = {
                 'alpha2': c['alpha-2'].lower(),
                 'name': c['name']
             }
+    return countries
 
-    ORIGINATING_BODY = {}
+
+@lru_cache(maxsize=1)
+def load_originating_body():
+    """
+        Return the originating bodies indexed by their identifier (cached).
+
+        :return: originating bodies type and name
+        :rtype: dict
+    """
     with open(os.path.join('data', 'originatingbody.json')) as f:
-        ORIGINATING_BODY = json.load(f)
+        return json.load(f)
+
+
+def format_case(c, countries, originating_bodies):
+    """
+        Format a single case from raw information
+
+        :param c: case raw information, with the semicolon separated fields already split
+        :type c: dict
+        :param countries: countries indexed by their alpha-3 code
+        :type countries: dict
+        :param originating_bodies: originating bodies indexed by their identifier
+        :type originating_bodies: dict
+        :return: formatted case
+        :rtype: dict
+    """
+    c['parties'] = format_parties(c['docname'])
+    c['__conclusion'] = c['conclusion']
+    c['conclusion'] = format_conclusion(c['__conclusion'])
+    c['__articles'] = c['article']
+    c['article'] = format_article(c['__articles'])
+    c['paragraphs'] = format_subarticle(c['__articles'])
+    c['country'] = dict(countries[c['respondent'].partition(';')[0]])
+    originating_body = originating_bodies[c['originatingbody']]
+    c['originatingbody_type'] = originating_body['type']
+    c['originatingbody_name'] = originating_body['name']
+
+    c['rank'] = c.pop('Rank')
+
+    del c['isplaceholder']
+    c['kpdate'] = c.pop('kpdateAsText')
+    del c['documentcollectionid2']
+    del c['doctype']
+    del c['meetingnumber']
+    return c
+
+
+def format_cases(console, cases):
+    """
+        Format the cases from raw information
+
+        :param cases: list of cases raw information
+        :type cases: [dict]
+        :return: list of formatted cases
+        :rtype: [dict]
+    """
+    countries = load_countries()
+    originating_bodies = load_originating_body()
+
+    # Split the semicolon separated fields column by column
+    split, strip = str.split, str.strip
+    for k in ['externalsources', 'documentcollectionid', 'issue', 'representedby']:
+        for c in cases:
+            v = c[k]
+            c[k] = [strip(e) for e in split(v, ';')] if len(v) > 0 else []
+    for c in cases:
+        c['extractedappno'] = [strip(e) for e in split(c['extractedappno'], ';')]
+    for c in cases:
+        c['kpthesaurus'] = split(c['kpthesaurus'], ';')
+    for c in cases:
+        v = c['scl']
+        c['scl'] = split(v, ';') if strip(v) else []
 
     with Progress(
             TAB + "> Format cases [IN PROGRESS]",
@@ -304,44 +431,10 @@ def format_cases(console, cases):
             console=console
     ) as progress:
         task = progress.add_task("Format", total=len(cases))
-        for i, c in enumerate(cases):
-            progress.update(task, advance=1)
-            cases[i]['parties'] = format_parties(cases[i]['docname'])
-            cases[i]['__conclusion'] = cases[i]['conclusion']
-            cases[i]['conclusion'] = format_conclusion(c['__conclusion'])
-            cases[i]['__articles'] = cases[i]['article']
-            cases[i]['article'] = format_article(cases[i]['__articles'])
-            cases[i]['paragraphs'] = format_subarticle(cases[i]['__articles'])
-            cases[i]['externalsources'] = cases[i]["externalsources"].split(';') if len(
-                cases[i]['externalsources']) > 0 else []
-            cases[i]["documentcollectionid"] = cases[i]["documentcollectionid"].split(';') if len(
-                cases[i]['documentcollectionid']) > 0 else []
-            cases[i]["issue"] = cases[i]["issue"].split(';') if len(cases[i]['issue']) > 0 else []
-            cases[i]["representedby"] = cases[i]["representedby"].split(';') if len(
-                cases[i]['representedby']) > 0 else []
-            cases[i]["extractedappno"] = cases[i]["extractedappno"].split(';')
-
-            cases[i]['externalsources'] = [e.strip() for e in cases[i]['externalsources']]
-            cases[i]['documentcollectionid'] = [e.strip() for e in cases[i]['documentcollectionid']]
-            cases[i]['issue'] = [e.strip() for e in cases[i]['issue']]
-            cases[i]['representedby'] = [e.strip() for e in cases[i]['representedby']]
-            cases[i]['extractedappno'] = [e.strip() for e in cases[i]['extractedappno']]
-
-            cases[i]['country'] = COUNTRIES[cases[i]['respondent'].split(';')[0]]
-            cases[i]['originatingbody_type'] = ORIGINATING_BODY[cases[i]['originatingbody']]['type']
-            cases[i]['originatingbody_name'] = ORIGINATING_BODY[cases[i]['originatingbody']]['name']
-
-            cases[i]["rank"] = cases[i]['Rank']
-            del cases[i]["Rank"]
-
-            del cases[i]["isplaceholder"]
-            cases[i]["kpdate"] = cases[i]['kpdateAsText']
-            del cases[i]['kpdateAsText']
-            del cases[i]["documentcollectionid2"]
-            cases[i]["kpthesaurus"] = cases[i]["kpthesaurus"].split(';')
-            cases[i]["scl"] = cases[i]["scl"].split(';') if cases[i]["scl"].strip() else []
-            del cases[i]["doctype"]
-            del cases[i]["meetingnumber"]
+        update = progress.update
+        for c in cases:
+            update(task, advance=1)
+            format_case(c, countries, originating_bodies)
     print(TAB + "> Format case [green][DONE]")
     return cases
 
@@ -370,12 +463,11 @@ def filter_cases(cases):
     # cases = [i for i in cases if i["application"].startswith("MS WORD")]
     # print('\tRemaining: {} ({}%)'.format(len(cases), 100 * float(len(cases)) / total ))
     print(TAB + '> Keep cases with a clear conclusion:')
-    cases = [i for i in cases if
-             "No-violation" in i["conclusion"] or "No violation" in i["conclusion"] or "Violation" in i[
-                 "conclusion"] or "violation" in i["conclusion"]]
+    # "No-violation" and "No violation" both contain "violation"
+    cases = [i for i in cases if "violation" in i["conclusion"] or "Violation" in i["conclusion"]]
     print(TAB + '  ⮡ Remaining: {} ({:.4f}%)'.format(len(cases), 100 * float(len(cases)) / total))
     print(TAB + '> Remove a specific list of cases hard to process:')
-    cases = [i for i in cases if i['itemid'] not in ["001-154354", "001-108395", "001-79411"]]
+    cases = [i for i in cases if i['itemid'] not in HARD_CASES]
     print(TAB + '  ⮡ Remaining: {} ({:.4f}%)'.format(len(cases), 100 * float(len(cases)) / total))
     print(TAB + '-' * 50)
     print(TAB + '> Final number of cases: {}'.format(len(cases)))
@@ -393,19 +485,21 @@ def generate_statistics(cases):
     """
 
     def generate_count(k, cases):
-        s = []
+        s = set()
+        add = s.add
         for c in cases:
+            v = c[k]
             if k == 'conclusion':
                 # We do not take into account mention and details
-                s.extend([a['element'] for a in c[k]])
-            else:
-                if isinstance(c[k], list):
-                    if len(c[k]):
-                        s.extend(c[k])
-                elif isinstance(c[k], str):  # string
-                    if len(c[k].strip()):
-                        s.append(c[k])
-        return s
+                for a in v:
+                    add(a['element'])
+            elif isinstance(v, list):
+                for e in v:
+                    add(e)
+            elif isinstance(v, str):  # string
+                if v.strip():
+                    add(v)
+        return len(s)
 
     table = Table()
     table.add_column("Attribute", style="cyan", no_wrap=True)
@@ -416,13 +510,12 @@ def generate_statistics(cases):
     except_k = []
     stats = {'attributes': {}}
     for k in [i for i in keys if i not in except_k]:
-        s = generate_count(k, cases)
-        s = Counter(s)
+        cardinal = generate_count(k, cases)
         stats['attributes'][k] = {
-            'cardinal': len(s),
-            'density': float(len(s)) / len(cases)
+            'cardinal': cardinal,
+            'density': float(cardinal) / len(cases)
         }
-        table.add_row(k, str(len(s)), '{:.4f}'.format(float(len(s)) / len(cases)))
+        table.add_row(k, str(cardinal), '{:.4f}'.format(float(cardinal) / len(cases)))
     print(table)
     return stats
 
@@ -439,14 +532,12 @@ def run(console, build, title, force=False):
     make_build_folder(console, output_folder, force, strict=False)
 
     cases = []
-    files = [path.join(input_folder, f) for f in listdir(input_folder) if path.isfile(path.join(input_folder, f)) if
-             '.json' in f]
+    with os.scandir(input_folder) as it:
+        files = [e.path for e in it if e.is_file() and '.json' in e.name]
     for p in files:
         try:
-            with open(p, 'r') as f:
-                content = f.read()
-                index = json.loads(content)
-                cases.extend(index["results"])
+            index = load_json(p)
+            cases.extend(index["results"])
         except Exception as e:
             log.info(p, e)
     cases = [c["columns"] for c in cases]
@@ -459,24 +550,19 @@ def run(console, build, title, force=False):
     print(Markdown("- **Generate statistics**"))
     stats = generate_statistics(cases)
 
-    with open(path.join(output_folder, 'filter.statistics.json'), 'w') as outfile:
-        json.dump(stats, outfile, indent=4, sort_keys=True)
-
-    with open(path.join(output_folder, 'raw_cases_info_all.json'), 'w') as outfile:
-        json.dump(cases, outfile, indent=4, sort_keys=True)
+    dump_json(stats, path.join(output_folder, 'filter.statistics.json'))
+    dump_json(cases, path.join(output_folder, 'raw_cases_info_all.json'))
 
     filtered_cases = []
     for c in cases:
-        classes = []
+        classes = {}  # Key: article / Value: conclusion type
+        opposed_classes = False
         for e in c['conclusion']:
             if e['type'] in ['violation', 'no-violation']:
                 if 'article' in e:
-                    g = e['article']
-                    classes.append('{}:{}'.format(g, 1 if e['type'] == 'violation' else 0))
-
-        classes = list(set(classes))
-        opposed_classes = any(
-            [e for e in classes if e.split(':')[0] + ':' + str(abs(1 - int(e.split(':')[-1]))) in classes])
+                    if classes.setdefault(e['article'], e['type']) != e['type']:
+                        opposed_classes = True
+                        break
         if len(classes) > 0 and not opposed_classes:
             filtered_cases.append(c)
 
@@ -500,8 +586,6 @@ def run(console, build, title, force=False):
                     cases_per_articles[e['article']].append(c)
 
     print(Markdown("- **Generate case listing for datasets**"))
-    multilabel_cases = []
-    multilabel_index = set()
     with Progress(
             TAB + "> Generate case info for specific article [IN PROGRESS]",
             "| {task.fields[progress_array]}",
@@ -516,51 +600,54 @@ def run(console, build, title, force=False):
             return '[{}{}]'.format(''.join(['[green]{}[white], '.format(e) for e in a[:-1]]), a[-1])
 
         task = progress.add_task("Generate datasets cases", total=len(outcomes), progress_array="[]")
-        for k in outcomes.keys():
-            progress_array.append(k)
-            with open(path.join(output_folder, 'raw_cases_info_article_{}.json'.format(k)), 'w') as outfile:
-                json.dump(cases_per_articles[k], outfile, indent=4, sort_keys=True)
-            multilabel_cases.extend(cases_per_articles[k])
-            for c in cases_per_articles[k]:
-                multilabel_index.add(c['itemid'])
-            progress.update(task, advance=1, progress_array=to_str(progress_array))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = {}
+            for k in outcomes.keys():
+                filename = path.join(output_folder, 'raw_cases_info_article_{}.json'.format(k))
+                futures[k] = executor.submit(dump_json, cases_per_articles[k], filename)
+            for k, future in futures.items():
+                future.result()
+                progress_array.append(k)
+                progress.update(task, advance=1, progress_array=to_str(progress_array))
     print(TAB + "> Generate case info for specific article [green][DONE]", )
-    multilabel_cases_unique = []
-    for c in multilabel_cases:
-        if c['itemid'] in multilabel_index:
-            multilabel_cases_unique.append(c)
-            multilabel_index.discard(c['itemid'])
-
-    with open(path.join(output_folder, 'raw_cases_info_multilabel.json'), 'w') as outfile:
-        json.dump(multilabel_cases_unique, outfile, indent=4, sort_keys=True)
+    multilabel_index = {}  # Key: case ID / Value = first case listed with this ID
+    for k in outcomes.keys():
+        for c in cases_per_articles[k]:
+            multilabel_index.setdefault(c['itemid'], c)
+    multilabel_cases_unique = list(multilabel_index.values())
+
+    dump_json(multilabel_cases_unique, path.join(output_folder, 'raw_cases_info_multilabel.json'))
     print(TAB + "> Generate case info for multilabel dataset [green][DONE]", )
     multiclass_index = {}  # Key: case ID / Value = number of different dataset it appears in
     multiclass_cases = []
-    sorted_outcomes = dict(sorted(outcomes.items(), key=lambda x: x[1]['total'])).keys()
+    totals = [(k, v['total']) for k, v in outcomes.items()]
+    totals.sort(key=itemgetter(1))
+    sorted_outcomes = [k for k, _ in totals]
     for k in sorted_outcomes:
         for c in cases_per_articles[k]:
             if c['itemid'] not in multiclass_index:
-                nb_datasets = [e['article'] for e in c['conclusion'] if 'article' in e]
-                if len(list(set(nb_datasets))) == 1:
-                    for cc in c['conclusion']:
-                        if 'article' in cc and cc['article'] == k:
-                            c['mc_conclusion'] = [cc]
+                first = None
+                unique = True
+                for e in c['conclusion']:
+                    if 'article' in e:
+                        if first is None:
+                            first = e
+                        elif e['article'] != first['article']:
+                            unique = False
                             break
-                    if 'mc_conclusion' in c:
+                if unique:
+                    if first is not None and first['article'] == k:
+                        c['mc_conclusion'] = [first]
                         multiclass_index[c['itemid']] = k
                         multiclass_cases.append(c)
                     else:
                         log.info('No article found for {}'.format(c['itemid']))
                 else:
+                    nb_datasets = set([e['article'] for e in c['conclusion'] if 'article' in e])
+                    log.info('Article {} in {} datasets: {}. Skip for multiclass.'.format(
+                        c['itemid'], len(nb_datasets), ','.join(nb_datasets)))
 
-                    log.info('Article {} in {} datasets: {}. Skip for multiclass.'.format(c['itemid'],
-                                                                                          len(set(nb_datasets)),
-                                                                                          ','.join(
-                                                                                              list(set(nb_datasets))))
-                             )
-
-    with open(path.join(output_folder, 'raw_cases_info_multiclass.json'), 'w') as outfile:
-        json.dump(multiclass_cases, outfile, indent=4, sort_keys=True)
+    dump_json(multiclass_cases, path.join(output_folder, 'raw_cases_info_multiclass.json'))
     print(TAB + "> Generate case info for multiclass [green][DONE]", )
 
 
@@ -1,8 +1,13 @@
+import json
 import pytest
 from copy import deepcopy
 
-from echr.steps.filter import split_and_format_article, format_cases, format_subarticle, format_article, format_parties,\
-    format_conclusion, filter_cases, generate_statistics, merge_conclusion_elements, find_base_articles
+from echr.steps.filter import (
+    split_and_format_article, format_cases, format_subarticle, format_article, format_parties,
+    format_conclusion, filter_cases, generate_statistics, merge_conclusion_elements,
+    find_base_articles, dump_json, load_json, iter_conclusion_segments
+)
+from echr.steps import filter as filter_step
 from echr.utils.misc import compare_two_lists
 from tests.data.test_filter_samples import merge_ccl, format_ccl, raw_cases_input, columns
 from rich.console import Console
@@ -32,6 +37,26 @@ class TestFormatConclusion:
         res = find_base_articles(articles=input)
         assert sorted(res) == sorted(output)
 
+    @staticmethod
+    @pytest.mark.parametrize("input,output", [
+        ('', []),
+        ('Violation of Article 3', [('Violation of Article 3', None)]),
+        ('Violation of Article 3;Violation of Article 13)',
+         [('Violation of Article 3', None), ('Violation of Article 13', None)]),
+        ('Violation of Article 3 (Substantive aspect;Procedural aspect)',
+         [('Violation of Article 3 ', ['Substantive aspect', 'Procedural aspect'])]),
+        ('A (x) (y(z))', [('A ', ['x']), (' ', ['y'])])
+    ])
+    def test_iter_conclusion_segments(input, output):
+        res = list(iter_conclusion_segments(input))
+        assert res == output
+
+    @staticmethod
+    def test_format_conclusion_repeated_conjunction():
+        ccl = 'Violation of Art. 3 and and art. 5'
+        res = format_conclusion(ccl)
+        assert res == [{'element': ccl, 'type': 'violation', 'article': '3', 'base_article': '3'}]
+
     @staticmethod
     @pytest.mark.parametrize("input,output", merge_ccl)
     def test_merge_conclusion_elements(input, output):
@@ -85,6 +110,11 @@ class TestFormatArticle:
         res = format_subarticle(input)
         assert sorted(res) == sorted(output)
 
+    @staticmethod
+    def test_format_article_keeps_order():
+        assert format_article("14+7;1;14;P4-1;7-1") == ['7', '14', '1', 'p4-1']
+        assert format_subarticle("14+7;1;14;P4-1;7-1") == ['14', '7', '1', 'P4-1', '7-1']
+
 
 class TestFilterCases:
     @staticmethod
@@ -107,6 +137,13 @@ class TestFormatCases:
     def test_values_not_empty(column):
         assert prepare_cases[0][column]
 
+    @staticmethod
+    def test_country_is_not_shared():
+        cases = format_cases(Console(), deepcopy(raw_cases_input[:2]))
+        cases[0]['country']['name'] = 'Modified'
+        res = format_cases(Console(), deepcopy(raw_cases_input[:2]))
+        assert res[0]['country']['name'] != 'Modified'
+
 
 class TestGenerateStatistics:
     @staticmethod
@@ -136,3 +173,32 @@ class TestGenerateStatistics:
         expected = {'attributes': {'conclusion': {'cardinal': 4, 'density': 4 / 3}}}
         res = generate_statistics(case)
         assert res == expected
+
+
+class TestDumpJson:
+    data = [{'b': 'SEYFETT\u0130N DEM\u0130R', 'a': ['3', 'p1-1'], 'density': 0.25},
+            {'itemid': '001-83979', 'conclusion': [], 'country': {}}]
+
+    @staticmethod
+    def test_round_trip(tmp_path):
+        p = tmp_path / 'cases.json'
+        dump_json(TestDumpJson.data, str(p))
+        with open(p, 'r', encoding='utf-8') as f:
+            assert json.load(f) == TestDumpJson.data
+        assert load_json(str(p)) == TestDumpJson.data
+
+    @staticmethod
+    def test_format(tmp_path):
+        p = tmp_path / 'cases.json'
+        dump_json({'b': 'D\u0130R', 'a': [1]}, str(p))
+        assert p.read_bytes() == '{\n  "a": [\n    1\n  ],\n  "b": "D\u0130R"\n}'.encode('utf-8')
+
+    @staticmethod
+    def test_fallback_writes_same_bytes(tmp_path, monkeypatch):
+        with_orjson = tmp_path / 'orjson.json'
+        without_orjson = tmp_path / 'json.json'
+        dump_json(TestDumpJson.data, str(with_orjson))
+        monkeypatch.setattr(filter_step, 'orjson', None)
+        dump_json(TestDumpJson.data, str(without_orjson))
+        assert with_orjson.read_bytes() == without_orjson.read_bytes()
+        assert load_json(str(without_orjson)) == TestDumpJson.data